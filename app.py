@@ -1,44 +1,61 @@
 import os
-import json
 import uuid
-from datetime import datetime
-from typing import Any, Dict
+import time
+import asyncio
+from typing import Any, Dict, List
 
-import requests
-from flask import Flask, request, jsonify
+import aiofiles
+import aiohttp
+from quart import Quart, request, jsonify
 
-app = Flask(__name__)
+from fileio import mkdir_fast, write_json
+
+app = Quart(__name__)
 
 BASE_OUTPUT_DIR = os.getenv("OUTPUT_BASE_DIR", "/data/outputs")
 
 FOLDERS = ["inputs", "pod", "digital", "palette", "pbn", "procreate", "previews"]
 
+# Shared session so repeated downloads reuse pooled keep-alive connections.
+# It has to be created inside the server's event loop, see _open_session.
+_SESSION: aiohttp.ClientSession | None = None
+
 
 def utc_now() -> str:
-    return datetime.utcnow().isoformat() + "Z"
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
 
 def ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
 
-def write_json(path: str, data: Dict[str, Any]):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-def append_log(log_path: str, msg: str):
-    with open(log_path, "a", encoding="utf-8") as f:
-        f.write(f"[{utc_now()}] {msg}\n")
-
-
-def download_file(url: str, out_path: str, timeout: int = 60):
-    r = requests.get(url, stream=True, timeout=timeout)
-    r.raise_for_status()
-    with open(out_path, "wb") as f:
-        for chunk in r.iter_content(chunk_size=1024 * 256):
-            if chunk:
-                f.write(chunk)
+def write_log(log_path: str, lines: List[str]):
+    # a job's log lines are collected in memory and appended with one
+    # O_APPEND write(), skipping the text-layer encode/buffer round trip
+    view = memoryview(("\n".join(lines) + "\n").encode("utf-8"))
+    fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+async def download_file(url: str, out_path: str, timeout: int = 60, retries: int = 3):
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+    for attempt in range(retries + 1):
+        try:
+            async with _SESSION.get(url, timeout=client_timeout) as r:
+                r.raise_for_status()
+                async with aiofiles.open(out_path, "wb") as f:
+                    async for chunk in r.content.iter_chunked(1024 * 1024):
+                        await f.write(chunk)
+            return
+        except aiohttp.ClientConnectionError:
+            # only connection failures are retried; HTTP error statuses are not
+            if attempt == retries:
+                raise
+            await asyncio.sleep(0.3 * 2 ** attempt)
 
 
 def validate_payload(p: Dict[str, Any]) -> str | None:
@@ -59,82 +76,128 @@ def validate_payload(p: Dict[str, Any]) -> str | None:
     return None
 
 
+@app.before_serving
+async def _open_session():
+    global _SESSION
+    _SESSION = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=32))
+
+
+@app.after_serving
+async def _close_session():
+    global _SESSION
+    if _SESSION is not None:
+        await _SESSION.close()
+        _SESSION = None
+
+
 @app.get("/health")
-def health():
+async def health():
     return jsonify({"ok": True, "service": "factory-service", "time": utc_now()})
 
 
 @app.post("/run")
-def run():
-    payload = request.get_json(force=True, silent=True)
+async def run():
+    payload = await request.get_json(force=True, silent=True)
     err = validate_payload(payload)
     if err:
         return jsonify({"ok": False, "error": err}), 400
 
+    if _SESSION is None:
+        # a setup problem, not a download failure: let it surface as a server error
+        raise RuntimeError("HTTP session is not open; before_serving did not run")
+
     job_id = payload["job_id"]
     output_folder = os.path.join(BASE_OUTPUT_DIR, job_id)
-    ensure_dir(output_folder)
-
-    # Create folder tree
-    for f in FOLDERS:
-        ensure_dir(os.path.join(output_folder, f))
+    # filesystem calls can block on network volumes; keep them off the event loop
+    await asyncio.to_thread(ensure_dir, output_folder)
+    await asyncio.to_thread(mkdir_fast, os.path.join(output_folder, "inputs"))
+
+    # Create the rest of the folder tree on the default executor while the
+    # source image downloads; failures are collected rather than raised here
+    rs = output_folder.rstrip("/") + "/"
+    tree = asyncio.gather(
+        *(asyncio.to_thread(mkdir_fast, rs + d) for d in FOLDERS if d != "inputs"),
+        return_exceptions=True,
+    )
 
     log_path = os.path.join(output_folder, "logs.txt")
-    append_log(log_path, f"RUN start job_id={job_id}")
+    ts = utc_now()
+    logs: List[str] = [f"[{ts}] RUN start job_id={job_id}"]
 
-    # Download source image
-    src_url = payload["assets"][0]["mj"]["image_url"]
-    ext = ".png"  # safe default; Discord often returns PNGs
-    source_path = os.path.join(output_folder, "inputs", f"source{ext}")
-
-    append_log(log_path, f"Downloading source image from: {src_url}")
     try:
-        download_file(src_url, source_path)
-    except Exception as e:
-        append_log(log_path, f"ERROR downloading image: {repr(e)}")
-        # write a failure manifest
+        # Download source image
+        src_url = payload["assets"][0]["mj"]["image_url"]
+        ext = ".png"  # safe default; Discord often returns PNGs
+        source_path = os.path.join(output_folder, "inputs", f"source{ext}")
+
+        logs.append(f"[{ts}] Downloading source image from: {src_url}")
+        try:
+            await download_file(src_url, source_path)
+        except Exception as e:
+            ts = utc_now()
+            # ClientResponseError's repr carries the full response headers
+            if isinstance(e, aiohttp.ClientResponseError):
+                reason = f"HTTP {e.status} {e.message}"
+            else:
+                reason = repr(e)
+            logs.append(f"[{ts}] ERROR downloading image: {reason}")
+            # the download error is what gets reported; tree errors are only logged
+            for tree_err in await tree:
+                if tree_err is not None:
+                    logs.append(f"[{ts}] ERROR creating folder tree: {repr(tree_err)}")
+            # write a failure manifest
+            manifest_path = os.path.join(output_folder, "manifest.json")
+            manifest = {
+                "job_id": job_id,
+                "status": "error",
+                "error": f"download_failed: {reason}",
+                "created_utc": ts,
+                "output_folder": output_folder,
+                "source_url": src_url,
+            }
+            write_json(manifest_path, manifest)
+            return jsonify({"ok": False, "error": "download_failed", "manifest_path": manifest_path}), 500
+
+        for tree_err in await tree:
+            if tree_err is not None:
+                raise tree_err
+        ts = utc_now()
+        logs.append(f"[{ts}] Saved source image: {source_path}")
+
+        # Write manifest
         manifest_path = os.path.join(output_folder, "manifest.json")
         manifest = {
             "job_id": job_id,
-            "status": "error",
-            "error": f"download_failed: {repr(e)}",
-            "created_utc": utc_now(),
+            "collection_id": payload.get("collection_id"),
+            "trend": payload.get("trend", {}),
+            "difficulty": payload.get("difficulty"),
+            "assets": payload.get("assets", []),
+            "requested_outputs": payload.get("requested_outputs", {}),
+            "status": "phase0_complete",
+            "created_utc": ts,
             "output_folder": output_folder,
-            "source_url": src_url,
+            "paths": {
+                "manifest": manifest_path,
+                "logs": log_path,
+                "source_image": source_path,
+            },
+            "files": [
+                {"path": source_path, "type": "input", "role": "source_image"}
+            ],
         }
         write_json(manifest_path, manifest)
-        return jsonify({"ok": False, "error": "download_failed", "manifest_path": manifest_path}), 500
-
-    append_log(log_path, f"Saved source image: {source_path}")
-
-    # Write manifest
-    manifest_path = os.path.join(output_folder, "manifest.json")
-    manifest = {
-        "job_id": job_id,
-        "collection_id": payload.get("collection_id"),
-        "trend": payload.get("trend", {}),
-        "difficulty": payload.get("difficulty"),
-        "assets": payload.get("assets", []),
-        "requested_outputs": payload.get("requested_outputs", {}),
-        "status": "phase0_complete",
-        "created_utc": utc_now(),
-        "output_folder": output_folder,
-        "paths": {
-            "manifest": manifest_path,
-            "logs": log_path,
-            "source_image": source_path,
-        },
-        "files": [
-            {"path": source_path, "type": "input", "role": "source_image"}
-        ],
-    }
-    write_json(manifest_path, manifest)
-    append_log(log_path, f"Wrote manifest: {manifest_path}")
-    append_log(log_path, "RUN complete")
-
-    return jsonify({
-        "ok": True,
-        "job_id": job_id,
-        "output_folder": output_folder,
-        "manifest_path": manifest_path
-    })
+        logs.append(f"[{ts}] Wrote manifest: {manifest_path}")
+        logs.append(f"[{ts}] RUN complete")
+
+        return jsonify({
+            "ok": True,
+            "job_id": job_id,
+            "output_folder": output_folder,
+            "manifest_path": manifest_path
+        })
+    except Exception as e:
+        logs.append(f"[{utc_now()}] ERROR: {repr(e)}")
+        raise
+    finally:
+        # the collected lines must reach disk whichever way the job ends
+        write_log(log_path, logs)
@@ -0,0 +1,91 @@
+"""
+File helpers shared by app.py, worker_phase0.py and transform_trends_to_jobs.py:
+JSON read/write (orjson when installed, stdlib json otherwise) and directory
+creation.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Outputs are consumed by other services; set PRETTY_JSON to indent them
+JSON_INDENT = 2 if os.getenv("PRETTY_JSON") else None
+
+# 20+ digit runs may be ints wider than 64 bits, which orjson reads as floats
+_LONG_DIGITS_B = re.compile(rb"[0-9]{20}")
+_LONG_DIGITS_S = re.compile(r"[0-9]{20}")
+
+
+def _has_non_finite(data: Any) -> bool:
+    stack = [data]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, float):
+            if not math.isfinite(o):
+                return True
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return False
+
+
+def loads_json(s: str | bytes) -> Any:
+    """
+    Parses with orjson, deferring to stdlib json where orjson would differ:
+    NaN/Infinity (orjson rejects them) and any document with a 20+ digit run,
+    since orjson silently turns ints wider than 64 bits into floats. A digit
+    run inside a string is a false positive that only costs speed.
+    """
+    long_digits = _LONG_DIGITS_B if isinstance(s, (bytes, bytearray)) else _LONG_DIGITS_S
+    if orjson is not None and long_digits.search(s) is None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(s)
+
+
+def read_json(path: str) -> Any:
+    with open(path, "rb") as f:
+        return loads_json(f.read())
+
+
+def write_json(path: str, data: Any) -> None:
+    """
+    Serializes fully before opening, so a failure can't leave a truncated file.
+    orjson handles the common case; stdlib json takes over for what orjson
+    would reject (ints wider than 64 bits) or silently rewrite (NaN/Infinity
+    become null), so whatever read_json accepted is written back unchanged.
+    """
+    blob = None
+    if orjson is not None and not _has_non_finite(data):
+        try:
+            blob = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if JSON_INDENT else 0))
+        except orjson.JSONEncodeError:
+            pass
+    if blob is None:
+        separators = None if JSON_INDENT else (",", ":")
+        blob = json.dumps(data, indent=JSON_INDENT, separators=separators).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(blob)
+
+
+def mkdir_fast(path: str) -> None:
+    # single mkdir for a leaf whose parent exists; makedirs would stat every component
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        # an existing directory is fine; a file in the way is not
+        if not os.path.isdir(path):
+            raise
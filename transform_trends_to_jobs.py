@@ -10,15 +10,31 @@ Usage:
 from __future__ import annotations
 
 import argparse
-import json
 import re
 from typing import Any, Dict, List, Optional
 
+from fileio import loads_json, read_json, write_json
+
+
+_FENCE = re.compile(r"```json\s*(\[\s*{.*}\s*\])\s*```", re.DOTALL)
+# drop spaces, ':' -> 'x' in aspect-ratio tokens
+_AR_TRANS = str.maketrans({" ": None, ":": "x"})
+
+
+class _SlugTable(dict):
+    """str.translate table: a-z0-9 map to themselves, everything else to '-'."""
+
+    def __missing__(self, c: int) -> str:
+        self[c] = "-"
+        return "-"
+
+
+_SLUG_TABLE = _SlugTable((ord(c), c) for c in "abcdefghijklmnopqrstuvwxyz0123456789")
+
 
 def slugify(s: str) -> str:
-    s = s.strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "-", s)
-    s = re.sub(r"-+", "-", s).strip("-")
+    # splitting on '-' and dropping empties collapses runs and trims the ends
+    s = "-".join(filter(None, s.lower().translate(_SLUG_TABLE).split("-")))
     return s[:80] if len(s) > 80 else s
 
 
@@ -47,16 +63,19 @@ def extract_inner_trends(raw: Any) -> List[Dict[str, Any]]:
             content = msg.get("content", [])
             for c in content:
                 if c.get("type") == "output_text":
-                    text = c.get("text", "")
-                    # Pull JSON inside code fences if present
-                    m = re.search(r"```json\s*(\[\s*{.*}\s*\])\s*```", text, flags=re.DOTALL)
+                    text = c.get("text", "").strip()
+                    # Try parsing raw text as JSON first; this skips the
+                    # DOTALL fence scan over large unfenced responses
+                    if text.startswith("[") and text.endswith("]"):
+                        try:
+                            return loads_json(text)
+                        except ValueError:
+                            pass
+                    # Otherwise pull JSON inside code fences if present
+                    m = _FENCE.search(text)
                     if m:
                         inner = m.group(1)
-                        return json.loads(inner)
-                    # Or try parsing raw text as JSON
-                    text = text.strip()
-                    if text.startswith("[") and text.endswith("]"):
-                        return json.loads(text)
+                        return loads_json(inner)
 
     raise ValueError("Could not locate embedded trends JSON in the wrapper.")
 
@@ -77,10 +96,11 @@ def normalize_variations(trend: Dict[str, Any], difficulty: str) -> List[Dict[st
 
     for v in variations:
         vtype = (v.get("type") or "asset").strip()
+        purpose = v.get("purpose")
         ar = (v.get("aspect_ratio") or "").strip()
 
         # normalize AR text into a stable token
-        ar_token = ar.replace("--ar", "").replace("--tile", "tile").replace(" ", "").replace(":", "x")
+        ar_token = ar.replace("--ar", "").replace("--tile", "tile").translate(_AR_TRANS)
         if "tile" in ar:
             ar_token = "1x1_tile"
 
@@ -89,7 +109,7 @@ def normalize_variations(trend: Dict[str, Any], difficulty: str) -> List[Dict[st
         asset: Dict[str, Any] = {
             "asset_id": asset_id,
             "type": vtype,
-            "purpose": v.get("purpose"),
+            "purpose": purpose,
             "aspect_ratio": ar_token or None,
             "lane": "pod_raster",
             "mj": {
@@ -105,7 +125,7 @@ def normalize_variations(trend: Dict[str, Any], difficulty: str) -> List[Dict[st
             }
 
         # Coordinate bath mat is NOT MJ-based in your rules
-        if vtype.lower() == "coordinate" and "bath" in (v.get("purpose") or "").lower():
+        if vtype.lower() == "coordinate" and "bath" in (purpose or "").lower():
             asset["lane"] = "generated"
             asset.pop("mj", None)
             asset.pop("pbn", None)
@@ -178,8 +198,7 @@ def parse_args() -> argparse.Namespace:
 
 def main() -> None:
     args = parse_args()
-    with open(args.in_path, "r", encoding="utf-8") as f:
-        raw = json.load(f)
+    raw = read_json(args.in_path)
 
     trends = extract_inner_trends(raw)
     if args.limit and args.limit > 0:
@@ -187,8 +206,7 @@ def main() -> None:
 
     jobs = [build_job(t, args.collection_id, args.difficulty, args.output_base_dir) for t in trends]
 
-    with open(args.out_path, "w", encoding="utf-8") as f:
-        json.dump(jobs, f, indent=2)
+    write_json(args.out_path, jobs)
 
     print(f"Wrote {len(jobs)} job payload(s) to {args.out_path}")
 
@@ -21,58 +21,105 @@ from __future__ import annotations
 import argparse
 import json
 import os
-from datetime import datetime
-from typing import Any, Dict, List
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
 
+from fileio import mkdir_fast, read_json, write_json
+
+
+FOLDERS = ["inputs", "pod", "digital", "palette", "pbn", "procreate", "previews"]
 
 REQUIRED_TOP_KEYS = ["job_id", "collection_id", "trend", "difficulty", "providers", "requested_outputs", "assets", "io"]
 
+# (key, expected type, error) checked when the key is present
+TOP_LEVEL_TYPES = [
+    ("job_id", str, "job_id must be a string"),
+    ("assets", list, "assets must be an array"),
+]
+
 
 def now_utc() -> str:
-    return datetime.utcnow().isoformat() + "Z"
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
 
 def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
 
-def write_text(path: str, text: str) -> None:
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(text + "\n")
+def ensure_tree(root: str, folders: List[str]) -> None:
+    # root must already exist (see ensure_dir)
+    # mkdirs are independent round-trips on network volumes; issue them concurrently
+    rs = root.rstrip("/") + "/"
+    with ThreadPoolExecutor(max_workers=len(folders)) as ex:
+        list(ex.map(lambda d: mkdir_fast(rs + d), folders))
 
 
-def validate_payload(p: Dict[str, Any]) -> List[str]:
-    errors: List[str] = []
-
+def write_text(path: str, text: str) -> None:
+    view = memoryview((text + "\n").encode("utf-8"))
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        # os.write may be partial; loop until the whole block is out
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def _compile_top_level_validator():
+    """
+    The top-level schema is fixed, so unroll it into straight-line Python once
+    at import time instead of looping over the key/type tables per payload.
+    """
+    ns: Dict[str, Any] = {}
+    src = ["def _validate_top_level(p, append):"]
     for k in REQUIRED_TOP_KEYS:
-        if k not in p:
-            errors.append(f"Missing top-level key: {k}")
-
-    if "job_id" in p and not isinstance(p["job_id"], str):
-        errors.append("job_id must be a string")
+        src.append(f"    if {k!r} not in p:")
+        src.append(f"        append({'Missing top-level key: ' + k!r})")
+    for i, (k, t, msg) in enumerate(TOP_LEVEL_TYPES):
+        # bind the type explicitly so non-builtin types resolve too
+        ns[f"_t{i}"] = t
+        src.append(f"    if {k!r} in p and not isinstance(p[{k!r}], _t{i}):")
+        src.append(f"        append({msg!r})")
+    exec("\n".join(src), ns)
+    return ns["_validate_top_level"]
+
+
+_validate_top_level = _compile_top_level_validator()
+
+
+def validate_payload(p: Dict[str, Any], max_errors: int = 16) -> Tuple[List[str], bool]:
+    """
+    Returns (errors, truncated): at most max_errors messages (0 = no limit),
+    stopping early once the limit is hit so a badly broken payload doesn't
+    build hundreds of them. truncated is True when checking stopped early.
+    """
+    errors: List[str] = []
+    append = errors.append
+    limit = max_errors if max_errors > 0 else sys.maxsize
 
-    if "assets" in p and not isinstance(p["assets"], list):
-        errors.append("assets must be an array")
+    _validate_top_level(p, append)
+    if len(errors) >= limit:
+        return errors[:limit], True
 
     # Validate assets structure
     assets = p.get("assets", [])
-    seen_ids = set()
     for i, a in enumerate(assets):
+        if len(errors) >= limit:
+            return errors[:limit], True
         if not isinstance(a, dict):
-            errors.append(f"assets[{i}] must be an object")
+            append(f"assets[{i}] must be an object")
             continue
         aid = a.get("asset_id")
         if not aid:
-            errors.append(f"assets[{i}] missing asset_id")
-        elif aid in seen_ids:
-            errors.append(f"Duplicate asset_id: {aid}")
-        else:
-            seen_ids.add(aid)
+            append(f"assets[{i}] missing asset_id")
+        elif not isinstance(aid, str):
+            append(f"assets[{i}].asset_id must be a string")
 
-        lane = a.get("lane")
-        if lane not in ("pod_raster", "pbn", "generated", "pod_raster_pbn", None):
-            # allow None for older transforms but encourage setting lane
-            pass
+        # lane is not validated yet: older transforms leave it unset, and
+        # pod_raster / pbn / generated / pod_raster_pbn are the known values
 
         # MJ fields required if it needs an image
         if a.get("generator") == "bathmat_texture_from_palette":
@@ -82,27 +129,44 @@ def validate_payload(p: Dict[str, Any]) -> List[str]:
         mj = a.get("mj")
         if mj:
             if not isinstance(mj, dict):
-                errors.append(f"assets[{i}].mj must be object")
+                append(f"assets[{i}].mj must be object")
             else:
                 if not mj.get("visual_prompt") and not mj.get("image_url"):
-                    errors.append(f"assets[{i}] needs mj.visual_prompt or mj.image_url")
+                    append(f"assets[{i}] needs mj.visual_prompt or mj.image_url")
 
         pbn = a.get("pbn")
         if pbn and not isinstance(pbn, dict):
-            errors.append(f"assets[{i}].pbn must be object")
+            append(f"assets[{i}].pbn must be object")
+
+    if len(errors) >= limit:
+        return errors[:limit], True
+
+    # Duplicate ids, counted in one pass and reported in first-seen order
+    # (non-string ids were already reported above and are not counted)
+    id_counts = Counter(
+        aid for a in assets if isinstance(a, dict) and isinstance(aid := a.get("asset_id"), str)
+    )
+    for aid, n in id_counts.items():
+        if aid and n > 1:
+            append(f"Duplicate asset_id: {aid}")
+            if len(errors) >= limit:
+                return errors[:limit], True
 
     # Providers sanity
     providers = p.get("providers", {})
     if not isinstance(providers, dict):
-        errors.append("providers must be object")
+        append("providers must be object")
     else:
         if "prodigi" not in providers or "printful" not in providers:
-            errors.append("providers must include prodigi and printful")
+            append("providers must include prodigi and printful")
 
-    return errors
+    return errors[:limit], len(errors) > limit
 
 
 def build_manifest(payload: Dict[str, Any], root: str) -> Dict[str, Any]:
+    # output roots are POSIX paths (/data/outputs/...); strip a trailing "/"
+    # (empty or slash-terminated job_id) so names join with exactly one "/"
+    rs = root.rstrip("/") + "/"
     return {
         "job_id": payload["job_id"],
         "collection_id": payload.get("collection_id"),
@@ -114,15 +178,9 @@ def build_manifest(payload: Dict[str, Any], root: str) -> Dict[str, Any]:
         "requested_outputs": payload.get("requested_outputs", {}),
         "paths": {
             "root": root,
-            "inputs": os.path.join(root, "inputs"),
-            "pod": os.path.join(root, "pod"),
-            "digital": os.path.join(root, "digital"),
-            "palette": os.path.join(root, "palette"),
-            "pbn": os.path.join(root, "pbn"),
-            "procreate": os.path.join(root, "procreate"),
-            "previews": os.path.join(root, "previews"),
-            "logs": os.path.join(root, "logs.txt"),
-            "manifest": os.path.join(root, "manifest.json")
+            **{d: rs + d for d in FOLDERS},
+            "logs": rs + "logs.txt",
+            "manifest": rs + "manifest.json"
         },
         "files": [],
         "assets": payload.get("assets", [])
@@ -138,11 +196,10 @@ def parse_args() -> argparse.Namespace:
 def main() -> None:
     args = parse_args()
 
-    with open(args.payload, "r", encoding="utf-8") as f:
-        payload = json.load(f)
+    payload = read_json(args.payload)
 
     # Validate
-    errors = validate_payload(payload)
+    errors, truncated = validate_payload(payload)
 
     out_base = payload.get("io", {}).get("output_base_dir") or "/data/outputs"
     job_id = payload.get("job_id", "job_unknown")
@@ -151,33 +208,48 @@ def main() -> None:
     ensure_dir(root)
     log_path = os.path.join(root, "logs.txt")
 
-    write_text(log_path, f"[{now_utc()}] Phase0 start")
-    write_text(log_path, f"[{now_utc()}] job_id={job_id}")
-    write_text(log_path, f"[{now_utc()}] output_base_dir={out_base}")
+    # Log lines are collected and written once at the end of the run
+    ts = now_utc()
+    logs: List[str] = [
+        f"[{ts}] Phase0 start",
+        f"[{ts}] job_id={job_id}",
+        f"[{ts}] output_base_dir={out_base}",
+    ]
+
+    try:
+        if errors:
+            logs.append(f"[{ts}] VALIDATION FAILED:")
+            for e in errors:
+                logs.append(f"  - {e}")
+            if truncated:
+                logs.append(f"  (stopped after {len(errors)} errors)")
+            # Flush before build_manifest, which can still raise on a malformed payload
+            write_text(log_path, "\n".join(logs))
+            logs.clear()
+            # Still write a manifest with failure status for debugging
+            manifest = build_manifest(payload, root)
+            manifest["status"] = "failed_validation"
+            manifest["validation_errors"] = errors
+            manifest["validation_truncated"] = truncated
+            write_json(os.path.join(root, "manifest.json"), manifest)
+            print(json.dumps({"ok": False, "errors": errors, "errors_truncated": truncated, "manifest": manifest["paths"]["manifest"]}, indent=2))
+            return
+
+        # Create folder tree
+        ensure_tree(root, FOLDERS)
 
-    if errors:
-        write_text(log_path, f"[{now_utc()}] VALIDATION FAILED:")
-        for e in errors:
-            write_text(log_path, f"  - {e}")
-        # Still write a manifest with failure status for debugging
         manifest = build_manifest(payload, root)
-        manifest["status"] = "failed_validation"
-        manifest["validation_errors"] = errors
-        with open(os.path.join(root, "manifest.json"), "w", encoding="utf-8") as mf:
-            json.dump(manifest, mf, indent=2)
-        print(json.dumps({"ok": False, "errors": errors, "manifest": manifest["paths"]["manifest"]}, indent=2))
-        return
-
-    # Create folder tree
-    for d in ["inputs", "pod", "digital", "palette", "pbn", "procreate", "previews"]:
-        ensure_dir(os.path.join(root, d))
-
-    manifest = build_manifest(payload, root)
-    with open(os.path.join(root, "manifest.json"), "w", encoding="utf-8") as mf:
-        json.dump(manifest, mf, indent=2)
-
-    write_text(log_path, f"[{now_utc()}] Phase0 complete: folder tree + manifest written")
-    print(json.dumps({"ok": True, "root": root, "manifest": manifest["paths"]["manifest"]}, indent=2))
+        write_json(os.path.join(root, "manifest.json"), manifest)
+
+        logs.append(f"[{now_utc()}] Phase0 complete: folder tree + manifest written")
+        print(json.dumps({"ok": True, "root": root, "manifest": manifest["paths"]["manifest"]}, indent=2))
+    except Exception as e:
+        logs.append(f"[{now_utc()}] ERROR: {e!r}")
+        raise
+    finally:
+        # Whatever was collected reaches disk, even if the run fails
+        if logs:
+            write_text(log_path, "\n".join(logs))
 
 
 if __name__ == "__main__":